@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+
+"""
+Reference version of the Assembler Class object from nb-4.3, built on
+the functions in debruijn_funcs.py and eulerian.py.
+"""
+
+
+import time
+import random
+import bisect
+import cProfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product, repeat
+import debruijn_funcs
+from cache import make_key
+from eulerian import eulerian_path
+
+
+## pipeline stages in order, each computed from the one before it, and the
+## parameters each stage is computed from
+STAGES = ("reads", "kmers", "edges", "assembly")
+STAGE_PARAMS = {
+    "reads": ("nreads", "rlen"),
+    "kmers": ("k", "packed"),
+    "edges": (),
+    "assembly": (),
+}
+
+
+
+def _stage_property(name):
+    """
+    returns a property for a stage that is computed when first read if its
+    parameters are set, and that invalidates later stages when assigned
+    or deleted
+    """
+    def getter(self):
+        if name not in self._values:
+            self._compute(name)
+        return self._values.get(name)
+
+    def setter(self, value):
+        self._invalidate(name)
+        self._values[name] = value
+
+    def deleter(self):
+        self._invalidate(name)
+
+    return property(getter, setter, deleter,
+                    doc="the {} stage, computed lazily".format(name))
+
+
+
+def _param_property(name, stage):
+    "returns a property for a parameter that invalidates stage on change"
+    def getter(self):
+        return self._params[name]
+
+    def setter(self, value):
+        if value != self._params[name]:
+            self._params[name] = value
+            self._invalidate(stage)
+
+    return property(getter, setter,
+                    doc="parameter of the {} stage".format(stage))
+
+
+
+class Assembler():
+    """
+    An object for constructing a debuijn graph from kmers of random reads.
+
+    The reads, kmers, edges and assembly are stages computed lazily when
+    first read, each from the stage before it and its own parameters:
+    nreads and rlen for the reads, k and packed for the kmers. Changing a
+    parameter (or assigning a stage, or the target) discards only the
+    stages after it, e.g., setting k keeps the reads but recomputes the
+    kmers, edges and assembly on next access.
+    """
+    reads = _stage_property("reads")
+    kmers = _stage_property("kmers")
+    edges = _stage_property("edges")
+    assembly = _stage_property("assembly")
+    nreads = _param_property("nreads", "reads")
+    rlen = _param_property("rlen", "reads")
+    k = _param_property("k", "kmers")
+    packed = _param_property("packed", "kmers")
+
+
+    def __init__(self, target_length, random_seed=123, cache=None,
+                 instrument=False, hook=None, profile=False):
+
+        ## computed stages, the parameters they depend on, and the cache
+        ## keys of the stages that were computed from their inputs. The
+        ## kmer size k and packed (kmers as 2-bit int codes) are here.
+        self._values = {}
+        self._params = {"nreads": None, "rlen": None, "k": None,
+                        "packed": False}
+        self._keys = {}
+        self._target = None
+
+        ## read start positions, per-window contigs and their stitched
+        ## sequence from run_windowed, kept apart from the assembly stage
+        ## since they are not built from the whole graph's edges
+        self.starts = None
+        self.contigs = None
+        self.windowed_assembly = None
+
+        ## the object's own random number generator, so that instances do
+        ## not share (or disturb) the global random state
+        self.rng = random.Random(random_seed)
+
+        ## optional cache.StageCache of stage results keyed by their inputs
+        self.cache = cache
+
+        ## prefix/suffix indexes and degree surplus kept by add_reads
+        self._index = None
+
+        ## per-stage records of {stage: {seconds, peak_bytes, count...}}
+        ## filled by run() if instrument, hook or profile is set. hook is
+        ## called as hook(stage, record) after each stage, and profile=True
+        ## also stores each stage's cProfile.Profile in record["profile"]
+        self.instrument = instrument or hook is not None or profile
+        self.hook = hook
+        self.profile = profile
+        self.stats = {}
+
+        ## run init functions
+        self._random_sequence(target_length)
+
+
+    @property
+    def target(self):
+        "the target sequence; assigning it discards every stage"
+        return self._target
+
+
+    @target.setter
+    def target(self, value):
+        self._target = value
+        self._invalidate("reads")
+
+
+    ## private functions
+    def _random_sequence(self, target_length):
+        self.target = debruijn_funcs.random_sequence(target_length, self.rng)
+
+
+    def _get_reads(self, nreads, rlen):
+        """
+        returns nreads of len rlen drawn from string. With packed kmers the
+        reads are a ReadSet of start offsets into the encoded target, not
+        string copies, counted by the numpy path of reads_to_kmers. The
+        starts are drawn from self.rng just as get_reads draws them.
+        """
+        if not self.packed:
+            self.reads = debruijn_funcs.get_reads(
+                self.target, nreads, rlen, self.rng)
+        else:
+            last_start = len(self.target) - rlen
+            starts = [self.rng.randint(0, last_start) for i in range(nreads)]
+            self.reads = debruijn_funcs.ReadSet.from_target(
+                self.target, starts, rlen)
+        self.starts = None
+
+
+    def _reads_to_kmers(self, k, batches=None):
+        "stores kmers dict for all reads, or for an iterable of read batches"
+        if batches is None:
+            self.kmers = debruijn_funcs.reads_to_kmers(
+                self.reads, k, self.packed)
+        else:
+            self.kmers = debruijn_funcs.reads_to_kmers(
+                batches, k, self.packed, batches=True)
+
+
+    def _get_debruijn_edges(self):
+        "return edges of the debruijn graph for a set of kmers"
+        self.edges = kmer_edges(self.kmers, self.k, self.packed)
+
+
+    def _get_eulerian_path(self):
+        """
+        returns eulerian path through kmers joined as a string.
+        Uses the loaded 'eulerian_path()' function from eulerian.py
+        """
+        self.assembly = spell_edges(self.edges, self.k, self.packed)
+
+
+    def _invalidate(self, name):
+        "discards stage name and every stage after it"
+        i = STAGES.index(name)
+        for stage in STAGES[i:]:
+            self._values.pop(stage, None)
+            self._keys.pop(stage, None)
+        ## the add_reads index is built from the kmers and edges
+        if i <= STAGES.index("edges"):
+            self._index = None
+
+
+    def _compute(self, name):
+        """
+        computes stage name after the stages before it, or leaves it unset
+        if a stage before it is None or one of its parameters is unset.
+        With a cache each stage's key is a hash of its parameters and the
+        key of the stage before it; the reads key includes the target and
+        the rng state, and a hit restores the rng state after the draw, so
+        results match an uncached run.
+        """
+        i = STAGES.index(name)
+        if i and getattr(self, STAGES[i - 1]) is None:
+            return
+        params = [self._params[param] for param in STAGE_PARAMS[name]]
+        if None in params:
+            return
+        func = {
+            "reads": self._get_reads,
+            "kmers": self._reads_to_kmers,
+            "edges": self._get_debruijn_edges,
+            "assembly": self._get_eulerian_path,
+        }[name]
+        args = params[:1] if name == "kmers" else params
+
+        ## stages computed from an assigned stage are not cached
+        if self.cache is None or (i and STAGES[i - 1] not in self._keys):
+            self._stage(name, func, *args)
+            return
+        if name == "reads":
+            key = make_key("reads", self.target, self.rng.getstate(), *params)
+            self._stage(name, self._cached_reads, key, *params)
+        else:
+            key = make_key(name, self._keys[STAGES[i - 1]], *params)
+            self._stage(name, self._cached_stage, key, name, func, *args)
+        self._keys[name] = key
+
+
+    ## public functions
+    def run(self, nreads, rlen, k, packed=False, batches=None):
+        """
+        generates reads, breaks them into kmers, builds the debruijn graph
+        and stores the assembled eulerian path. If packed=True the kmers,
+        edges and graph nodes are 2-bit packed ints (requires k <= 32).
+        Only the stages whose parameters changed since the last run are
+        recomputed, so to draw new reads with the same nreads and rlen
+        first discard the old ones with `del data.reads`.
+
+        To assemble real reads enter batches as an iterable of read lists,
+        e.g., debruijn_funcs.iter_read_batches("reads.fq.gz"). The batches
+        are counted as they are read and never stored, and nreads and rlen
+        are ignored.
+
+        If the Assembler was made with instrument, hook or profile set,
+        self.stats holds a record of each stage computed in the last run.
+        """
+        self.stats = {}
+        self.contigs = None
+        self.windowed_assembly = None
+        self.k = k
+        self.packed = packed
+        if batches is not None:
+            self.reads = None
+            self.starts = None
+            self._stage("kmers", self._reads_to_kmers, k, batches)
+        else:
+            ## reads left unset by an earlier run on batches
+            if "reads" in self._values and self._values["reads"] is None:
+                self._invalidate("reads")
+            self.nreads = nreads
+            self.rlen = rlen
+        self.assembly
+
+
+    def _stage(self, name, func, *args):
+        """
+        calls func(*args) and, if instrumenting, records its wall time,
+        tracemalloc peak and the size of its result in self.stats[name]
+        """
+        if not self.instrument:
+            func(*args)
+            return
+
+        ## nested inside an outer trace only the peak is reset
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+        profiler = cProfile.Profile() if self.profile else None
+        start = time.perf_counter()
+        try:
+            if profiler is None:
+                func(*args)
+            else:
+                profiler.runcall(func, *args)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+
+        record = {"seconds": seconds, "peak_bytes": peak}
+        record.update(self._stage_counts(name))
+        if profiler is not None:
+            record["profile"] = profiler
+        self.stats[name] = record
+        if self.hook is not None:
+            self.hook(name, record)
+
+
+    def _stage_counts(self, name):
+        "returns a dict of the number of objects made by a stage"
+        if name == "reads":
+            return {"nreads": None if self.reads is None else len(self.reads)}
+        if name == "kmers":
+            return {"nkmers": len(self.kmers)}
+        if name == "edges":
+            return {"nedges": len(self.edges)}
+        if name == "contigs":
+            return {"ncontigs": len(self.contigs)}
+        if name == "windowed_assembly":
+            return {"assembly_length": len(self.windowed_assembly)}
+        return {"assembly_length": len(self.assembly)}
+
+
+    def run_windowed(self, nreads, rlen, k, window=100000, overlap=None,
+                     packed=False, workers=None):
+        """
+        assembles a long target in overlapping windows. The reads are drawn
+        as in run() along with their start positions, and each read goes to
+        every window that holds it whole. Each window's reads are assembled
+        into a contig in a process pool of workers (None for all cores, 1 to
+        run in this process) and the contigs, stored in self.contigs, are
+        stitched on their overlaps into self.windowed_assembly. Windows
+        overlap by overlap bases (default 2 * rlen), which must be at least
+        rlen + k so that neighbouring contigs share a kmer. The windowed
+        assembly is "" if any window fails to assemble or to overlap its
+        neighbour. The reads become the reads stage, so reading self.kmers,
+        self.edges or self.assembly afterwards builds the whole graph from
+        them, as run() would, without touching the windowed assembly.
+        """
+        if overlap is None:
+            overlap = 2 * rlen
+        if overlap < rlen + k:
+            raise ValueError("overlap must be at least rlen + k")
+        if window <= overlap:
+            raise ValueError("window must be larger than overlap")
+
+        self.stats = {}
+        self.k = k
+        self.packed = packed
+        self._params["nreads"] = nreads
+        self._params["rlen"] = rlen
+        self._stage("reads", self._get_positioned_reads, nreads, rlen)
+        self._stage("contigs", self._assemble_windows, window, overlap, workers)
+        self._stage("windowed_assembly", self._stitch_contigs, overlap)
+
+
+    def _get_positioned_reads(self, nreads, rlen):
+        "draws reads as _get_reads does and also stores their start points"
+        self.reads, self.starts = debruijn_funcs.get_reads(
+            self.target, nreads, rlen, self.rng, starts=True)
+
+
+    def _assemble_windows(self, window, overlap, workers):
+        "stores the contig assembled from the reads of each window"
+        ## window start points, with the last window reaching the end
+        step = window - overlap
+        wstarts = [0]
+        while wstarts[-1] + window < len(self.target):
+            wstarts.append(wstarts[-1] + step)
+
+        ## reads sorted by start so each window's reads are one slice
+        order = sorted(range(len(self.reads)), key=self.starts.__getitem__)
+        starts = [self.starts[i] for i in order]
+        jobs = []
+        for wstart in wstarts:
+            lo = bisect.bisect_left(starts, wstart)
+            hi = lo
+            while (hi < len(order) and
+                   starts[hi] + len(self.reads[order[hi]]) <= wstart + window):
+                hi += 1
+            jobs.append([self.reads[i] for i in order[lo:hi]])
+
+        if workers == 1:
+            self.contigs = [
+                assemble_reads(reads, self.k, self.packed) for reads in jobs]
+            return
+        with ProcessPoolExecutor(workers) as pool:
+            self.contigs = list(pool.map(
+                assemble_reads, jobs, repeat(self.k), repeat(self.packed)))
+
+
+    def _stitch_contigs(self, overlap):
+        "stores the contigs joined on their overlaps as the windowed assembly"
+        self.windowed_assembly = stitch_contigs(self.contigs, self.k, overlap)
+
+
+    def _cached_reads(self, key, nreads, rlen):
+        "sets reads and the rng state from the cache, or draws and caches"
+        value = self.cache.get(key)
+        if value is None:
+            self._get_reads(nreads, rlen)
+            self.cache.put(key, (self.reads, self.rng.getstate()))
+        else:
+            self.reads, state = value
+            self.rng.setstate(state)
+
+
+    def _cached_stage(self, key, name, func, *args):
+        "sets attribute name from the cache, or by calling func and caching"
+        value = self.cache.get(key)
+        if value is None:
+            func(*args)
+            self.cache.put(key, getattr(self, name))
+        else:
+            setattr(self, name, value)
+
+
+    def add_reads(self, reads):
+        """
+        adds a batch of reads to the current graph. The kmer counts are
+        updated and only kmers not seen before add edges, found from
+        prefix and suffix indexes of the kmers. The eulerian path is only
+        re-attempted if edges were added and the degree balance allows a
+        path; otherwise the assembly is kept (no new edges) or set to ""
+        (unbalanced). Requires a previous call to run(). The reads can be
+        any iterable, e.g., debruijn_funcs.iter_fastx(path).
+        """
+        if self.kmers is None:
+            raise ValueError("call run() before add_reads()")
+        reads = list(reads)
+        if self._index is None:
+            self._build_index()
+        prefixes, suffixes, surplus = self._index
+        if self.reads is not None:
+            self.reads.extend(reads)
+
+        ## count kmers and collect the ones not seen before
+        newkmers = []
+        ikmers = debruijn_funcs.reads_to_kmers(reads, self.k, self.packed)
+        for kmer, count in ikmers.items():
+            if kmer not in self.kmers:
+                newkmers.append(kmer)
+                self.kmers[kmer] = 0
+                prefixes.setdefault(self._prefix(kmer), []).append(kmer)
+                suffixes.setdefault(self._suffix(kmer), []).append(kmer)
+            self.kmers[kmer] += count
+
+        ## if xaa = aax then add (xaa, aax), for new kmers on either end
+        nedges = len(self.edges)
+        for kmer in newkmers:
+            for k2 in prefixes.get(self._suffix(kmer), ()):
+                self._add_edge(kmer, k2, surplus)
+            for k1 in suffixes.get(self._prefix(kmer), ()):
+                self._add_edge(k1, kmer, surplus)
+
+        if len(self.edges) == nedges:
+            return
+        values = list(surplus.values())
+        if (len(values) <= 2 and sum(values) == 0
+                and all(abs(value) == 1 for value in values)):
+            self._get_eulerian_path()
+        else:
+            self.assembly = ""
+
+
+    def _prefix(self, kmer):
+        "returns the (k-1)-prefix of a kmer"
+        return kmer >> 2 if self.packed else kmer[:-1]
+
+
+    def _suffix(self, kmer):
+        "returns the (k-1)-suffix of a kmer"
+        if self.packed:
+            return kmer & ((1 << 2 * (self.k - 1)) - 1)
+        return kmer[1:]
+
+
+    def _add_edge(self, k1, k2, surplus):
+        "adds an edge and updates the out- minus in-degree of its ends"
+        if (k1, k2) in self.edges:
+            return
+        self.edges.add((k1, k2))
+        for kmer, change in ((k1, 1), (k2, -1)):
+            value = surplus.get(kmer, 0) + change
+            if value:
+                surplus[kmer] = value
+            else:
+                surplus.pop(kmer, None)
+
+
+    def _build_index(self):
+        """
+        indexes the kmers by prefix and suffix and stores the degree surplus
+        of unbalanced nodes. The kmers and edges are copied first since they
+        may be shared with a cache, and their cache keys are dropped since
+        add_reads changes them in place.
+        """
+        values = self._values
+        if values.get("reads") is not None:
+            values["reads"] = list(values["reads"])
+        values["kmers"] = dict(self.kmers)
+        values["edges"] = set(self.edges)
+        self._keys.clear()
+        prefixes = {}
+        suffixes = {}
+        for kmer in self.kmers:
+            prefixes.setdefault(self._prefix(kmer), []).append(kmer)
+            suffixes.setdefault(self._suffix(kmer), []).append(kmer)
+        surplus = {}
+        for k1, k2 in self.edges:
+            surplus[k1] = surplus.get(k1, 0) + 1
+            surplus[k2] = surplus.get(k2, 0) - 1
+        surplus = {kmer: value for kmer, value in surplus.items() if value}
+        self._index = (prefixes, suffixes, surplus)
+
+
+    def test(self, target_sizes=(200, 500, 1000), nreads=(500, 1000, 5000),
+             ks=(10, 20, 30), rlen=50, workers=1):
+        """
+        returns dict of whether assembly == target over a range of params.
+        The cells are run by sweep(), in parallel if workers > 1, and the
+        results are the same for any number of workers.
+        """
+        grid = {
+            "target_size": target_sizes,
+            "nreads": nreads,
+            "k": ks,
+            "rlen": [rlen],
+        }
+        result_dict = {}
+        for cell, result in sweep(grid, workers=workers):
+            key = (cell["target_size"], cell["nreads"], cell["k"])
+            result_dict[key] = result["assembled"]
+        return dict(sorted(result_dict.items()))
+
+
+    def plot(self):
+        "returns a toyplot graph of the debruijn edges"
+        import toyplot
+        e0 = [i[0] for i in self.edges]
+        e1 = [i[1] for i in self.edges]
+        return toyplot.graph(e0, e1, tmarker=">", vlstyle={'font-size': '8px'})
+
+
+
+def kmer_edges(kmers, k, packed=False):
+    """
+    returns the set of (kmer, kmer) edges between kmers where the (k-1)-
+    suffix of one is the (k-1)-prefix of the other. If packed the kmers
+    are 2-bit int codes of length k.
+    """
+    ## index kmers by their (k-1)-prefix: {aa: [aax, aay, ...]}
+    prefixes = {}
+    if packed:
+        mask = (1 << 2 * (k - 1)) - 1
+        for kmer in kmers:
+            prefixes.setdefault(kmer >> 2, []).append(kmer)
+        suffixes = (kmer & mask for kmer in kmers)
+    else:
+        for kmer in kmers:
+            prefixes.setdefault(kmer[:-1], []).append(kmer)
+        suffixes = (kmer[1:] for kmer in kmers)
+
+    ## if xaa = aax then add (xaa, aax)
+    edges = set()
+    for k1, suffix in zip(kmers, suffixes):
+        for k2 in prefixes.get(suffix, ()):
+            edges.add((k1, k2))
+    return edges
+
+
+
+def spell_edges(edges, k, packed=False):
+    "returns the sequence of the eulerian path of kmer edges, or '' if none"
+    try:
+        epath = eulerian_path(edges)
+    except Exception:
+        return ""
+
+    ## packed kmers are only decoded to strings here
+    if packed:
+        return debruijn_funcs.spell_path(epath, k)
+    return debruijn_funcs.spell_path(epath)
+
+
+
+def assemble_reads(reads, k, packed=False):
+    "returns the sequence assembled from reads, or '' if it fails"
+    if not reads:
+        return ""
+    kmers = debruijn_funcs.reads_to_kmers(reads, k, packed)
+    return spell_edges(kmer_edges(kmers, k, packed), k, packed)
+
+
+
+def stitch_contigs(contigs, k, overlap):
+    """
+    returns contigs joined in order, each onto the one before it where the
+    first k bases of the next contig match within the last overlap bases
+    of the sequence so far and the rest of that tail agrees with it.
+    Returns "" if any contig is empty or does not overlap.
+    """
+    if not contigs or not all(contigs):
+        return ""
+    seq = contigs[0]
+    for contig in contigs[1:]:
+        anchor = contig[:k]
+        pos = seq.find(anchor, max(0, len(seq) - overlap))
+        while pos != -1 and not contig.startswith(seq[pos:]):
+            pos = seq.find(anchor, pos + 1)
+        if pos == -1:
+            return ""
+        seq = seq[:pos] + contig
+    return seq
+
+
+
+## defaults for any parameter missing from a sweep grid
+SWEEP_DEFAULTS = {
+    "target_size": 500,
+    "nreads": 1000,
+    "rlen": 50,
+    "k": 20,
+    "packed": False,
+    "replicate": 0,
+}
+
+
+
+def run_cell(cell, seed=123, cache=None, hook=None):
+    """
+    runs one assembly for a dict of parameters and returns a dict of
+    results. The target is drawn from seed, so it is shared by all cells
+    of the same target_size, and the reads from a stream seeded by the
+    seed and the read parameters, so each cell is reproducible on its own
+    no matter which process runs it or in what order. Cells that differ
+    only in k (or packed) get the same reads, which a cache can reuse.
+    A hook is passed to the Assembler to receive each stage's stats.
+    """
+    data = Assembler(cell["target_size"], random_seed=seed, cache=cache,
+                     hook=hook)
+    data.rng.seed("{}:{target_size}:{nreads}:{rlen}:{replicate}"
+                  .format(seed, **cell))
+    data.run(cell["nreads"], cell["rlen"], cell["k"], packed=cell["packed"])
+    return {
+        "assembled": data.assembly == data.target,
+        "nkmers": len(data.kmers),
+        "nedges": len(data.edges),
+        "assembly_length": len(data.assembly),
+    }
+
+
+
+def sweep(grid, workers=1, seed=123, cache=None):
+    """
+    yields (cell, result) for every combination of the parameter lists in
+    grid, e.g., {"target_size": [200, 500], "k": [10, 20, 30],
+    "replicate": range(10)}, with any missing parameter taken from
+    SWEEP_DEFAULTS. If workers > 1 (or None for all cores) the cells run in
+    a process pool and are yielded as they finish; each cell's result is
+    the same whichever way it is run (see run_cell). A cache.StageCache
+    lets repeated cells skip their stages; worker processes share only
+    its disk store.
+    """
+    names = sorted(grid)
+    cells = []
+    for values in product(*(grid[name] for name in names)):
+        cell = dict(SWEEP_DEFAULTS)
+        cell.update(zip(names, values))
+        cells.append(cell)
+
+    if workers == 1:
+        for cell in cells:
+            yield cell, run_cell(cell, seed, cache)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(run_cell, cell, seed, cache): cell
+                   for cell in cells}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+
+if __name__ == "__main__":
+
+    # run a test
+    data = Assembler(200)
+    data.run(300, 50, 15)
+    print(data.assembly == data.target)
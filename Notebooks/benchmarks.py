@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks for each stage of the debruijn assembly pipeline across target
+sizes and kmer sizes. Times and peak memory are written to a JSON file and
+can be compared against a stored baseline to flag regressions, e.g.:
+
+    python benchmarks.py --out baseline.json
+    python benchmarks.py --out new.json --baseline baseline.json
+"""
+
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import debruijn_funcs
+import eulerian
+
+
+## default scales, from 1 kbp to 10 Mbp
+SIZES = (1000, 10000, 100000, 1000000, 10000000)
+KS = (10, 21, 31)
+SYNTHETIC_NODES = (1000, 100000, 1000000)
+
+
+
+def measure(func, *args, memory=True, repeat=1):
+    """
+    returns (result, seconds, peak_bytes) of calling func(*args), where
+    seconds is the best of repeat calls. The peak memory comes from one
+    more call traced by tracemalloc so that tracing does not slow the
+    timed calls (peak_bytes is None if memory=False).
+    """
+    seconds = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+
+def _record(results, name, seconds, peak, **info):
+    "stores one benchmark result under a unique name"
+    results[name] = dict(info, seconds=seconds, peak_bytes=peak)
+
+
+
+def _eulerian_or_none(edges):
+    "returns the eulerian path of edges or None if there is none"
+    try:
+        return eulerian.eulerian_path(edges)
+    except eulerian.NoEulerianPath:
+        return None
+
+
+
+def bench_pipeline(results, size, ks, coverage=10, rlen=100, seed=123,
+                   memory=True, repeat=1):
+    """
+    benchmarks every pipeline stage for one target size; the target and
+    reads are simulated once and the kmer stages run for each k in ks
+    """
+    random.seed(seed)
+    nreads = max(1, coverage * size // rlen)
+
+    target, sec, peak = measure(debruijn_funcs.random_sequence, size,
+                                memory=memory, repeat=repeat)
+    _record(results, "random_sequence:{}".format(size), sec, peak, size=size)
+
+    reads, sec, peak = measure(debruijn_funcs.get_reads, target, nreads, rlen,
+                               memory=memory, repeat=repeat)
+    _record(results, "get_reads:{}".format(size), sec, peak,
+            size=size, nreads=nreads)
+
+    for k in ks:
+        _bench_kmer_stages(results, target, reads, k, memory, repeat)
+
+
+
+def _bench_kmer_stages(results, target, reads, k, memory, repeat):
+    """
+    benchmarks the stages from kmer counting to spelling for one k. The
+    counting stages run on the reads, but the graph stages run on the
+    target's own kmers, which have no coverage gaps, so that the eulerian
+    path exists wherever the target has no repeated (k-1)-mers.
+    """
+    info = {"size": len(target), "k": k}
+    name = "{{}}:{}:{}".format(len(target), k)
+    kmers, sec, peak = measure(debruijn_funcs.reads_to_kmers, reads, k, True,
+                               memory=memory, repeat=repeat)
+    _record(results, name.format("reads_to_kmers"), sec, peak,
+            nkmers=len(kmers), **info)
+
+    arrays, sec, peak = measure(debruijn_funcs.reads_to_kmer_arrays, reads, k,
+                                memory=memory, repeat=repeat)
+    _record(results, name.format("reads_to_kmer_arrays"), sec, peak,
+            nkmers=len(arrays[0]), **info)
+
+    kmers = debruijn_funcs.get_kmers(target, k, packed=True)
+    edges, sec, peak = measure(debruijn_funcs.get_debruijn_edges, kmers,
+                               False, k, memory=memory, repeat=repeat)
+    _record(results, name.format("get_debruijn_edges"), sec, peak,
+            nedges=len(edges), **info)
+
+    ## a failed search stops at the degree check, so it is not recorded
+    ## as a traversal time
+    path, sec, peak = measure(_eulerian_or_none, edges,
+                              memory=memory, repeat=repeat)
+    if path is None:
+        print("no eulerian path for size={} k={}, not recorded"
+              .format(len(target), k), file=sys.stderr)
+        path = list(debruijn_funcs.iter_kmer_codes(target, k - 1))
+    else:
+        _record(results, name.format("eulerian_path"), sec, peak, **info)
+
+    ## spell the (k-1)-mer path, or all of the target's kmers if none
+    _, sec, peak = measure(debruijn_funcs.spell_path, path, k - 1,
+                           memory=memory, repeat=repeat)
+    _record(results, name.format("spell_path"), sec, peak,
+            length=len(path), **info)
+
+
+
+def synthetic_graph(nnodes, seed=123):
+    """
+    returns the edges of a connected balanced graph of int nodes: a ring
+    of nnodes with a short cycle hanging off about every tenth node, so
+    the eulerian path must splice in many circuits.
+    """
+    rng = random.Random(seed)
+    edges = [(i, (i + 1) % nnodes) for i in range(nnodes)]
+    extra = nnodes
+    for i in range(0, nnodes, 10):
+        length = rng.randint(1, 5)
+        loop = [i] + list(range(extra, extra + length)) + [i]
+        edges.extend(zip(loop, loop[1:]))
+        extra += length
+    return edges
+
+
+
+def bench_synthetic(results, nnodes, memory=True, repeat=1):
+    "benchmarks eulerian_path, with and without compaction, on a synthetic graph"
+    edges = synthetic_graph(nnodes)
+    for compact in (False, True):
+        _, sec, peak = measure(eulerian.eulerian_path, edges, compact,
+                               memory=memory, repeat=repeat)
+        name = "eulerian_path_synthetic:{}:{}".format(
+            nnodes, "compact" if compact else "full")
+        _record(results, name, sec, peak, nnodes=nnodes, nedges=len(edges))
+
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.005,
+            min_bytes=65536):
+    """
+    returns a list of messages for results whose time or peak memory is
+    more than tolerance (a fraction) above the same benchmark in baseline
+    and also more than min_seconds or min_bytes above it, so that timer
+    and allocator noise on tiny stages is not flagged
+    """
+    floors = {"seconds": min_seconds, "peak_bytes": min_bytes}
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key, floor in floors.items():
+            new, old = result.get(key), base.get(key)
+            if new is None or not old:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append("{} {}: {:.4g} -> {:.4g} (+{:.0%})".format(
+                    name, key, old, new, new / old - 1))
+    return regressions
+
+
+
+def main(argv=None):
+    "runs the benchmarks and returns 1 if any regression was flagged"
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--ks", type=int, nargs="+", default=KS)
+    parser.add_argument("--nodes", type=int, nargs="+", default=SYNTHETIC_NODES)
+    parser.add_argument("--coverage", type=int, default=10)
+    parser.add_argument("--rlen", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="time each stage as the best of this many calls")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc runs for peak memory")
+    parser.add_argument("--out", default="benchmarks.json")
+    parser.add_argument("--baseline", help="JSON file of earlier results")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-seconds", type=float, default=0.005,
+                        help="ignore time increases smaller than this")
+    parser.add_argument("--min-bytes", type=int, default=65536,
+                        help="ignore peak memory increases smaller than this")
+    args = parser.parse_args(argv)
+
+    memory = not args.no_memory
+    results = {}
+    for size in args.sizes:
+        bench_pipeline(results, size, args.ks, args.coverage, args.rlen,
+                       memory=memory, repeat=args.repeat)
+        print("done size={}".format(size), file=sys.stderr)
+    for nnodes in args.nodes:
+        bench_synthetic(results, nnodes, memory=memory, repeat=args.repeat)
+        print("done synthetic nodes={}".format(nnodes), file=sys.stderr)
+
+    with open(args.out, "w") as out:
+        json.dump({"python": platform.python_version(),
+                   "results": results}, out, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)["results"]
+        regressions = compare(results, baseline, args.tolerance,
+                              args.min_seconds, args.min_bytes)
+        for message in regressions:
+            print("REGRESSION", message)
+        return 1 if regressions else 0
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+A content-addressed cache for the results of pipeline stages, used by the
+Assembler to skip stages whose inputs have been seen before.
+"""
+
+
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+
+
+def make_key(*parts):
+    "returns a hex digest identifying a tuple of picklable inputs"
+    return hashlib.sha1(pickle.dumps(parts, protocol=4)).hexdigest()
+
+
+
+class StageCache():
+    """
+    A bounded in-memory LRU cache of up to maxsize entries, optionally
+    backed by a directory of pickle files. The directory is trimmed to
+    max_bytes by removing the least recently used files, and files are
+    written aside and moved into place so that several processes can
+    share it. Pickling a StageCache keeps its settings but not its memory,
+    so a copy sent to a worker process starts empty and shares the disk.
+    """
+    def __init__(self, maxsize=128, path=None, max_bytes=2**30):
+
+        ## store attributes
+        self.maxsize = maxsize
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize, "path": self.path,
+                "max_bytes": self.max_bytes}
+
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+
+    def get(self, key):
+        "returns the value stored for key, or None if it is not cached"
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        if self.path is not None:
+            try:
+                with open(self._file(key), "rb") as infile:
+                    value = pickle.load(infile)
+                ## mark the file as recently used for eviction
+                os.utime(self._file(key))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+            else:
+                self._remember(key, value)
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+
+    def put(self, key, value):
+        "stores value for key in memory and, if there is one, on disk"
+        self._remember(key, value)
+        if self.path is not None:
+            tmpfile = "{}.tmp{}".format(self._file(key), os.getpid())
+            with open(tmpfile, "wb") as out:
+                pickle.dump(value, out, protocol=4)
+            os.replace(tmpfile, self._file(key))
+            self._evict()
+
+
+    def clear(self):
+        "removes every entry from memory and disk"
+        self._memory.clear()
+        if self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(self.path, name))
+
+
+    def _remember(self, key, value):
+        "stores value in the memory LRU, dropping the oldest entries"
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+
+    def _evict(self):
+        "removes the least recently used files until under max_bytes"
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".pkl"):
+                ## another process may remove files while we scan
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -6,20 +6,178 @@ and a debruijn graph.
 """
 
 
+import os
+import gzip
 import random
+import zlib
+from itertools import chain, islice, repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from sketches import BloomFilter, CountMinSketch
 #from eulerian import eulerian_path
 
 
-def random_sequence(nbases):
-    return "".join((random.choice("ACGT") for i in range(nbases)))
+## 2-bit codes used to pack kmers into integers (k <= 32 fits 64 bits)
+BASES = "ACGT"
+CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+MAX_PACKED_K = 32
 
+## table for complementing bases in a string
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
 
+## lookup table from ascii byte to 2-bit code, 255 marks a non-ACGT base
+BASE_TABLE = np.full(256, 255, dtype=np.uint8)
+for _base, _code in CODES.items():
+    BASE_TABLE[ord(_base)] = _code
+
+## and back from 2-bit code to ascii byte, with N for any other code
+ASCII_TABLE = np.full(256, ord("N"), dtype=np.uint8)
+ASCII_TABLE[:4] = np.frombuffer(BASES.encode("ascii"), dtype=np.uint8)
+
+
+
+def random_sequence(nbases, rng=random):
+    "returns a random dna string, drawn from rng (a random.Random) if entered"
+    return "".join((rng.choice("ACGT") for i in range(nbases)))
+
+
+
+def random_sequence_array(nbases, seed=None):
+    """
+    returns a random target as a uint8 array of 2-bit base codes drawn
+    from a numpy Generator (or a seed for one), the vectorized version of
+    random_sequence. Use array_to_sequence to get the string.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4, size=nbases, dtype=np.uint8)
+
+
+
+def array_to_sequence(codes):
+    "returns the dna string of a uint8 array of 2-bit base codes (255 is N)"
+    return ASCII_TABLE[codes].tobytes().decode("ascii")
+
+
+
+def get_read_starts(target_length, nreads, rlen, seed=None):
+    """
+    returns an int64 array of nreads read start positions drawn in one
+    call from a numpy Generator (or a seed for one), the vectorized
+    version of the start points in get_reads.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, target_length - rlen, size=nreads,
+                        endpoint=True, dtype=np.int64)
+
+
+
+def simulate_reads(target_length, nreads, rlen, seed=None):
+    """
+    returns (target, starts): a random target as a uint8 code array and
+    the start positions of nreads reads of length rlen, both drawn from
+    one numpy Generator so the same seed gives the same simulation.
+    """
+    rng = np.random.default_rng(seed)
+    target = random_sequence_array(target_length, rng)
+    starts = get_read_starts(target_length, nreads, rlen, rng)
+    return target, starts
+
+
+
+def encode_kmer(kmer):
+    "returns a kmer string packed into an int using 2 bits per base"
+    code = 0
+    try:
+        for base in kmer:
+            code = (code << 2) | CODES[base]
+    except KeyError as err:
+        raise ValueError("cannot pack base {} in kmer {}".format(err, kmer))
+    return code
+
+
+
+def decode_kmer(code, k):
+    "returns the kmer string of length k for a packed int code"
+    bases = []
+    for i in range(k):
+        bases.append(BASES[code & 3])
+        code >>= 2
+    return "".join(reversed(bases))
+
+
+
+def reverse_complement(kmer):
+    "returns the reverse complement of a kmer string"
+    return kmer.translate(COMPLEMENT)[::-1]
+
+
+
+def reverse_complement_code(code, k):
+    "returns the reverse complement of a packed kmer code of length k"
+    rc = 0
+    for i in range(k):
+        rc = (rc << 2) | (3 - (code & 3))
+        code >>= 2
+    return rc
+
+
+
+def _check_packed_k(k):
+    "raises ValueError if k is too large to pack into a 64-bit int"
+    if not 0 < k <= MAX_PACKED_K:
+        raise ValueError("packed kmers require 0 < k <= {}, got k={}"
+                         .format(MAX_PACKED_K, k))
+
+
+
+def iter_kmer_codes(target, k, canonical=False):
+    """
+    yields the packed int code of each kmer in a string target by rolling
+    one base at a time into a 2-bit code, so no per-window slices are made.
+    Windows that contain a base other than ACGT are skipped. If canonical
+    is True the reverse complement code is rolled alongside and the
+    smaller of the two is yielded.
+    """
+    _check_packed_k(k)
+    mask = (1 << 2 * k) - 1
+    shift = 2 * (k - 1)
+    code = rc = 0
+    filled = 0
+    for base in target:
+        bits = CODES.get(base)
+        if bits is None:
+            code = rc = filled = 0
+            continue
+        code = ((code << 2) | bits) & mask
+        rc = (rc >> 2) | ((3 - bits) << shift)
+        filled += 1
+        if filled >= k:
+            if canonical and rc < code:
+                yield rc
+            else:
+                yield code
+
+
+
+def get_kmers(target, k, packed=False, canonical=False):
+    """
+    returns k-mers dict for a string target. If packed=True the keys are
+    2-bit packed int codes built by iter_kmer_codes instead of strings.
+    If canonical=True each kmer is keyed by min(kmer, reverse complement)
+    so that kmers from either strand are counted together.
+    """
+    if packed:
+        kmers = {}
+        for kmer in iter_kmer_codes(target, k, canonical):
+            kmers[kmer] = kmers.get(kmer, 0) + 1
+        return kmers
 
-def get_kmers(target, k):
-    "returns k-mers dict for a string target"
     kmers = {}
     for i in range(0, len(target) - k + 1):
         kmer = target[i:i+k]
+        if canonical:
+            kmer = min(kmer, reverse_complement(kmer))
         if kmer in kmers:
             kmers[kmer] += 1
         else:
@@ -28,29 +186,549 @@ def get_kmers(target, k):
 
 
 
-def get_reads(string, nreads, rlen):
-    "returns nreads of len rlen drawn from string"  
+def get_reads(string, nreads, rlen, rng=random, starts=False):
+    """
+    returns nreads of len rlen drawn from string using rng for start points,
+    or (reads, startpoints) if starts=True. The reads are the same either way.
+    """
     last_start = len(string) - rlen
-    startpoints = [random.randint(0, last_start) for i in range(nreads)]
+    startpoints = [rng.randint(0, last_start) for i in range(nreads)]
     reads = [string[i:i+rlen] for i in startpoints]
+    if starts:
+        return reads, startpoints
     return reads
 
 
 
-def reads_to_kmers(reads, k):
-    "stores kmers to dict uses update to join together kmer dict keys"
+def iter_fastx(path):
+    """
+    yields the read sequences in a fasta or fastq file one at a time, so
+    the reads are never all held in memory. Gzipped files are detected
+    from their magic bytes and sequences are returned in upper case.
+    """
+    with open(path, "rb") as infile:
+        gzipped = infile.read(2) == b"\x1f\x8b"
+    opener = gzip.open if gzipped else open
+
+    with opener(path, "rt") as infile:
+        lines = (line.rstrip() for line in infile)
+        lines = (line for line in lines if line)
+        first = next(lines, "")
+
+        ## fastq: 4 lines per record (@name, sequence, +, qualities)
+        if first.startswith("@"):
+            for seq in lines:
+                yield seq.upper()
+                next(lines, None)
+                next(lines, None)
+                next(lines, None)
+
+        ## fasta: sequences may be wrapped over several lines
+        elif first.startswith(">"):
+            seq = []
+            for line in lines:
+                if line.startswith(">"):
+                    yield "".join(seq).upper()
+                    seq = []
+                else:
+                    seq.append(line)
+            yield "".join(seq).upper()
+
+        elif first:
+            raise ValueError("{} is not a fasta or fastq file".format(path))
+
+
+
+def iter_read_batches(path, batchsize=10000):
+    "yields lists of up to batchsize reads from a fasta or fastq file"
+    reads = iter_fastx(path)
+    while True:
+        batch = list(islice(reads, batchsize))
+        if not batch:
+            return
+        yield batch
+
+
+
+def reads_to_kmers(reads, k, packed=False, canonical=False, workers=1,
+                   batches=False):
+    """
+    stores kmers to dict summing the counts of kmers across reads. The
+    reads can be any iterable, e.g., iter_fastx(path), and are consumed
+    one at a time. Set batches=True to pass an iterable of read lists,
+    e.g., iter_read_batches(path). If workers > 1 the reads are counted
+    in parallel processes, see reads_to_kmers_parallel.
+    """
+    if batches:
+        reads = chain.from_iterable(reads)
+    if packed and isinstance(reads, ReadSet):
+        codes, counts = reads_to_kmer_arrays(reads, k, canonical=canonical)
+        return dict(zip(codes.tolist(), counts.tolist()))
+    if workers > 1:
+        return reads_to_kmers_parallel(reads, k, packed, canonical, workers)
     kmers = {}
     for read in reads:
-        ikmers = get_kmers(read, k)
-        kmers.update(ikmers)
+        ikmers = get_kmers(read, k, packed, canonical)
+        for kmer, count in ikmers.items():
+            kmers[kmer] = kmers.get(kmer, 0) + count
+    return kmers
+
+
+
+def reads_to_kmers_bloom(reads, k, expected, fp_rate=0.01, packed=False,
+                         canonical=False):
+    """
+    returns a kmers dict holding only kmers seen at least twice. First
+    occurrences go into a Bloom filter sized for `expected` distinct kmers
+    and only kmers already in the filter enter the exact table, so the
+    many error singletons in real reads never reach the dict. At about
+    fp_rate a first occurrence is a false positive, so a singleton can
+    slip through and a count can be one too high.
+    """
+    bloom = BloomFilter(expected, fp_rate)
+    kmers = {}
+    for read in reads:
+        if packed:
+            readkmers = iter_kmer_codes(read, k, canonical)
+        else:
+            readkmers = get_kmers(read, k, canonical=canonical)
+            readkmers = (kmer for kmer, count in readkmers.items()
+                         for i in range(count))
+        for kmer in readkmers:
+            if kmer in kmers:
+                kmers[kmer] += 1
+            elif bloom.add(kmer):
+                kmers[kmer] = 2
     return kmers
+
+
+
+def reads_to_sketch(reads, k, width=2**20, depth=4, seed=0, chunksize=100000,
+                    canonical=False):
+    """
+    returns a CountMinSketch of the packed kmers in reads, for abundance
+    estimates in fixed memory (4 * width * depth bytes). The reads are
+    encoded and counted with numpy a chunk at a time and each chunk's
+    counts are added to the sketch, so no table of all kmers is kept.
+    Sketches of different reads made with the same width, depth and seed
+    (e.g., in other processes) can be combined with sketch.merge().
+    """
+    _check_packed_k(k)
+    sketch = CountMinSketch(width, depth, seed)
+    if isinstance(reads, ReadSet):
+        for part in reads.iter_kmer_arrays(k, chunksize, canonical):
+            sketch.update(*part)
+        return sketch
+
+    reads = iter(reads)
+    while True:
+        chunk = list(islice(reads, chunksize))
+        if not chunk:
+            return sketch
+        bases, lengths = reads_to_base_array(chunk)
+        sketch.update(*_count_kmer_codes(bases, lengths, k, canonical))
+
+
+
+def reads_to_kmers_multi(reads, ks, canonical=False):
+    """
+    returns {k: kmers dict} of packed kmer codes for every k in ks, made
+    in a single pass over the reads. One rolling code of the largest k is
+    kept, and the kmer of each smaller k is its low 2k bits (the canonical
+    reverse complement is the high 2k bits of the rolling reverse code).
+    """
+    ks = sorted(set(ks))
+    kmax = ks[-1]
+    _check_packed_k(ks[0])
+    _check_packed_k(kmax)
+    mask = (1 << 2 * kmax) - 1
+    shift = 2 * (kmax - 1)
+    masks = [(k, (1 << 2 * k) - 1, 2 * (kmax - k)) for k in ks]
+    tables = {k: {} for k in ks}
+
+    for read in reads:
+        code = rc = 0
+        filled = 0
+        for base in read:
+            bits = CODES.get(base)
+            if bits is None:
+                code = rc = filled = 0
+                continue
+            code = ((code << 2) | bits) & mask
+            rc = (rc >> 2) | ((3 - bits) << shift)
+            filled += 1
+            for k, kmask, rcshift in masks:
+                if filled < k:
+                    break
+                kmer = code & kmask
+                if canonical and rc >> rcshift < kmer:
+                    kmer = rc >> rcshift
+                table = tables[k]
+                table[kmer] = table.get(kmer, 0) + 1
+    return tables
+
+
+
+def _kmer_partition(kmer, nparts):
+    "returns the partition of a kmer; the same in every process"
+    if isinstance(kmer, str):
+        return zlib.crc32(kmer.encode("ascii")) % nparts
+    return kmer % nparts
+
+
+
+def _count_partitioned(reads, k, packed, canonical, nparts):
+    "returns the kmers dict of some reads split into nparts dicts by hash"
+    parts = [{} for i in range(nparts)]
+    for kmer, count in reads_to_kmers(reads, k, packed, canonical).items():
+        parts[_kmer_partition(kmer, nparts)][kmer] = count
+    return parts
+
+
+
+def _merge_partition(tables):
+    "returns a kmers dict summing the counts of several kmers dicts"
+    kmers = {}
+    for table in tables:
+        for kmer, count in table.items():
+            kmers[kmer] = kmers.get(kmer, 0) + count
+    return kmers
+
+
+
+def reads_to_kmers_parallel(reads, k, packed=False, canonical=False, workers=None):
+    """
+    returns the same kmers dict as reads_to_kmers but counted in a pool of
+    worker processes. Each worker counts a chunk of reads and splits its
+    table into one partition per worker by kmer hash, then each worker
+    merges one partition from every chunk, so the merge is parallel too.
+    The reads are held in memory to be split into chunks.
+    """
+    reads = list(reads)
+    nparts = workers or os.cpu_count()
+    size = -(-len(reads) // nparts) or 1
+    chunks = [reads[i:i+size] for i in range(0, len(reads), size)]
+
+    with ProcessPoolExecutor(nparts) as pool:
+
+        ## count each chunk into partitioned tables
+        counted = list(pool.map(
+            _count_partitioned, chunks,
+            repeat(k), repeat(packed), repeat(canonical), repeat(nparts)))
+
+        ## merge the same partition from every chunk; partitions are disjoint
+        merged = pool.map(
+            _merge_partition,
+            [[parts[j] for parts in counted] for j in range(nparts)])
+        kmers = {}
+        for part in merged:
+            kmers.update(part)
+    return kmers
+
+
+
+def reads_to_base_array(reads):
+    """
+    returns a uint8 array of 2-bit base codes for all reads concatenated
+    (non-ACGT bases are 255) and an int array of the read lengths.
+    """
+    buf = np.frombuffer("".join(reads).encode("ascii"), dtype=np.uint8)
+    lengths = np.fromiter((len(read) for read in reads), dtype=np.int64,
+                          count=len(reads))
+    return BASE_TABLE[buf], lengths
+
+
+
+def _window_codes(bases, k, canonical=False):
+    """
+    returns the packed code of every length k window of a base array and
+    a bool array that is False for windows holding a non-ACGT base
+    """
+    ## pack every window into a code by shifting in one column at a time
+    windows = sliding_window_view(bases, k)
+    codes = np.zeros(windows.shape[0], dtype=np.uint64)
+    for j in range(k):
+        codes <<= np.uint64(2)
+        codes |= windows[:, j]
+
+    ## the reverse complement reads the columns backwards and complemented
+    if canonical:
+        rcs = np.zeros(windows.shape[0], dtype=np.uint64)
+        for j in range(k - 1, -1, -1):
+            rcs <<= np.uint64(2)
+            rcs |= 3 - windows[:, j]
+        np.minimum(codes, rcs, out=codes)
+
+    bad = np.concatenate(([0], np.cumsum(bases > 3)))
+    return codes, bad[k:] == bad[:-k]
+
+
+
+def _count_kmer_codes(bases, lengths, k, canonical=False):
+    "returns sorted unique packed kmer codes and counts for a base array"
+    if bases.size < k:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    codes, valid = _window_codes(bases, k, canonical)
+
+    ## drop windows that cross a read boundary or hold a non-ACGT base
+    ends = np.repeat(np.cumsum(lengths), lengths)[:codes.size]
+    valid &= ends - np.arange(codes.size) >= k
+    return np.unique(codes[valid], return_counts=True)
+
+
+
+def _add_kmer_arrays(codes, counts, part):
+    """
+    returns sorted unique codes and counts with the sorted unique (codes,
+    counts) of a part added. The part's codes are found in codes by binary
+    search, and the new ones are placed at their found position plus the
+    number of new codes before them, so the merge is linear and the
+    running table is never re-sorted. Existing counts are added in place.
+    """
+    pcodes, pcounts = part
+    pos = np.searchsorted(codes, pcodes)
+    found = pos < codes.size
+    found[found] = codes[pos[found]] == pcodes[found]
+    counts[pos[found]] += pcounts[found]
+
+    ## slots of the new codes in the merged arrays; the rest keep order
+    new = ~found
+    at = pos[new] + np.arange(np.count_nonzero(new))
+    old = np.ones(codes.size + at.size, dtype=bool)
+    old[at] = False
+    mcodes = np.empty(old.size, dtype=np.uint64)
+    mcounts = np.empty(old.size, dtype=np.int64)
+    mcodes[at] = pcodes[new]
+    mcounts[at] = pcounts[new]
+    mcodes[old] = codes
+    mcounts[old] = counts
+    return mcodes, mcounts
+
+
+
+def reads_to_kmer_arrays(reads, k, chunksize=100000, canonical=False):
+    """
+    returns sorted arrays of unique packed kmer codes and their counts for
+    all reads, counted with numpy in chunks of chunksize reads. This is the
+    vectorized equivalent of reads_to_kmers(reads, k, packed=True). The
+    reads can be any iterable, or a ReadSet, and only one chunk is held at
+    a time.
+    """
+    _check_packed_k(k)
+    codes = np.empty(0, dtype=np.uint64)
+    counts = np.empty(0, dtype=np.int64)
+    if isinstance(reads, ReadSet):
+        for part in reads.iter_kmer_arrays(k, chunksize, canonical):
+            codes, counts = _add_kmer_arrays(codes, counts, part)
+        return codes, counts
+
+    reads = iter(reads)
+    while True:
+        chunk = list(islice(reads, chunksize))
+        if not chunk:
+            return codes, counts
+        bases, lengths = reads_to_base_array(chunk)
+        part = _count_kmer_codes(bases, lengths, k, canonical)
+        codes, counts = _add_kmer_arrays(codes, counts, part)
     
     
 
-def get_debruijn_edges(kmers):
-    " doc string"
+class ReadSet():
+    """
+    A set of reads stored as start offsets and lengths into one shared
+    uint8 buffer of 2-bit base codes (255 for non-ACGT), so simulated
+    reads are views of the target instead of copied strings, and reads
+    from files are packed into one contiguous buffer. The numpy kmer
+    stages (reads_to_kmer_arrays, reads_to_sketch, and reads_to_kmers
+    with packed=True) read kmers straight from the buffer. Iterating or
+    indexing a ReadSet returns read strings, made one at a time.
+    """
+    def __init__(self, buffer, starts, lengths):
+        self.buffer = np.asarray(buffer, dtype=np.uint8)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+
+
+    @classmethod
+    def from_target(cls, target, starts, rlen):
+        """
+        returns reads of length rlen at starts (e.g., from simulate_reads)
+        over a target string or uint8 code array, without copying it
+        """
+        if isinstance(target, str):
+            target = BASE_TABLE[np.frombuffer(target.encode("ascii"), np.uint8)]
+        starts = np.asarray(starts, dtype=np.int64)
+        return cls(target, starts, np.full(starts.size, rlen, dtype=np.int64))
+
+
+    @classmethod
+    def from_reads(cls, reads):
+        "returns a ReadSet packing an iterable of read strings into one buffer"
+        buffer, lengths = reads_to_base_array(list(reads))
+        starts = np.cumsum(lengths) - lengths
+        return cls(buffer, starts, lengths)
+
+
+    @classmethod
+    def from_file(cls, path, batchsize=100000):
+        "returns a ReadSet of the reads in a (gzipped) fasta or fastq file"
+        buffers = []
+        lengths = []
+        for batch in iter_read_batches(path, batchsize):
+            buffer, blengths = reads_to_base_array(batch)
+            buffers.append(buffer)
+            lengths.append(blengths)
+        if not buffers:
+            return cls([], [], [])
+        lengths = np.concatenate(lengths)
+        return cls(np.concatenate(buffers), np.cumsum(lengths) - lengths,
+                   lengths)
+
+
+    def __len__(self):
+        return self.starts.size
+
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        return array_to_sequence(self.buffer[start:start + self.lengths[i]])
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def iter_kmer_arrays(self, k, chunksize=100000, canonical=False):
+        """
+        yields sorted unique packed kmer codes and counts for each chunk of
+        chunksize reads. The window codes are computed over the part of
+        the buffer a chunk spans and gathered at each read's windows. If
+        the chunks' spans overlap, as for reads of a target, the codes are
+        instead computed once over the whole buffer and shared by all.
+        """
+        ends = self.starts + self.lengths
+        spans = [(self.starts[i:i+chunksize].min(), ends[i:i+chunksize].max())
+                 for i in range(0, len(self), chunksize)]
+        shared = sum(high - low for low, high in spans) > self.buffer.size
+        whole = None
+
+        for i, (low, high) in zip(range(0, len(self), chunksize), spans):
+            starts = self.starts[i:i+chunksize]
+            lengths = self.lengths[i:i+chunksize]
+            nkmers = np.maximum(lengths - k + 1, 0)
+            if not nkmers.sum():
+                continue
+            if not shared:
+                codes, clean = _window_codes(self.buffer[low:high], k, canonical)
+            else:
+                if whole is None:
+                    whole = _window_codes(self.buffer, k, canonical)
+                codes, clean = whole
+                low = 0
+
+            ## index of every kmer window of every read in the span
+            firsts = np.cumsum(nkmers) - nkmers
+            index = np.repeat(starts - low - firsts, nkmers)
+            index += np.arange(index.size)
+            index = index[clean[index]]
+            yield np.unique(codes[index], return_counts=True)
+
+
+
+def spell_path(path, k=None):
+    """
+    returns the sequence spelled by a path of overlapping kmers, i.e., the
+    first kmer plus the last base of each kmer after it, built in one pass.
+    If the path holds packed int codes then k (the length of the path's
+    kmers) must be entered and the bases are written into a bytearray.
+    """
+    if not path:
+        return ""
+    if k is None:
+        return path[0] + "".join([kmer[-1] for kmer in path[1:]])
+
+    seq = bytearray(k + len(path) - 1)
+    seq[:k] = decode_kmer(path[0], k).encode("ascii")
+    table = BASES.encode("ascii")
+    for i, code in enumerate(path[1:], k):
+        seq[i] = table[code & 3]
+    return seq.decode("ascii")
+
+
+
+def get_debruijn_edges(kmers, quadratic=False, k=None, canonical=False):
+    """
+    returns edges between (k-1)-mers of kmers that overlap by k-1. The
+    kmers are indexed by their (k-1)-prefix so that the successors of
+    each kmer are found with a single lookup. Set quadratic=True to use
+    the original all-by-all comparison (for validating results). If the
+    kmers are packed ints then k must be entered and the edges are
+    between packed (k-1)-mer codes.
+
+    If canonical=True the kmers are canonical (see get_kmers) and the
+    result is a bidirected graph with one edge per kmer, from its
+    (k-1)-prefix to its (k-1)-suffix. Each edge can also be walked on
+    the opposite strand, so traverse it with
+    eulerian.bidirected_eulerian_path and a reverse complement function.
+    """
+    if canonical:
+        return _get_canonical_debruijn_edges(kmers, k)
+    if quadratic:
+        return _get_debruijn_edges_quadratic(kmers, k)
+    if k is not None:
+        return _get_packed_debruijn_edges(kmers, k)
+
+    ## index kmers by their (k-1)-prefix: {aa: [aax, aay, ...]}
+    prefixes = {}
+    for kmer in kmers:
+        prefixes.setdefault(kmer[:-1], []).append(kmer)
+
+    ## if xaa = aax then add (aa, ax)
+    edges = set()
+    for k1 in kmers:
+        for k2 in prefixes.get(k1[1:], ()):
+            edges.add((k1[1:], k2[1:]))
+    return edges
+
+
+
+def _get_packed_debruijn_edges(kmers, k):
+    "returns debruijn edges for kmers packed as int codes"
+    ## the (k-1)-suffix is the low bits, the (k-1)-prefix the high bits
+    mask = (1 << 2 * (k - 1)) - 1
+    prefixes = {}
+    for kmer in kmers:
+        prefixes.setdefault(kmer >> 2, []).append(kmer)
+
+    edges = set()
+    for k1 in kmers:
+        for k2 in prefixes.get(k1 & mask, ()):
+            edges.add((k1 & mask, k2 & mask))
+    return edges
+
+
+
+def _get_canonical_debruijn_edges(kmers, k=None):
+    "returns one (prefix, suffix) edge for each canonical kmer"
+    if k is None:
+        return set((kmer[:-1], kmer[1:]) for kmer in kmers)
+    mask = (1 << 2 * (k - 1)) - 1
+    return set((kmer >> 2, kmer & mask) for kmer in kmers)
+
+
+
+def _get_debruijn_edges_quadratic(kmers, k=None):
+    "returns debruijn edges by comparing every kmer to every other kmer"
     edges = set()
     kmers = tuple(kmers.keys())
+    if k is not None:
+        mask = (1 << 2 * (k - 1)) - 1
+        for k1 in kmers:
+            for k2 in kmers:
+                if k1 & mask == k2 >> 2:
+                    edges.add((k1 & mask, k2 & mask))
+        return edges
     for k1 in kmers:
         for k2 in kmers:
             ## if xaa = aax then add (aa, ax)
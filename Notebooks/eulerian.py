@@ -2,6 +2,7 @@
 
 
 from collections import defaultdict
+import numpy as np
 
 class Graph:
     """A directed graph whose nodes are any hashable objects."""
@@ -45,10 +46,105 @@ class Graph:
     def degree(self, node):
         """Return the number of edges incident to node in either direction."""
         return self.in_degree(node) + self.out_degree(node)
-    
 
 
-from collections import deque
+def _csr(rows, cols, nnodes):
+    """Return the offsets and column arrays of the edges rows->cols."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    order = np.argsort(rows, kind="stable")
+    offsets = np.zeros(nnodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=nnodes), out=offsets[1:])
+    return offsets, cols[order]
+
+
+class CSRGraph:
+    """A read-only directed graph stored in compressed sparse row arrays.
+
+    Nodes are relabelled to dense integers 0..N-1. If they are all
+    strings or all ints (e.g. packed kmer codes) labels is a sorted
+    array; any other hashable nodes are numbered in order of first
+    appearance and labels is a list. The out-edges of node i are
+    out_targets[out_offsets[i]:out_offsets[i+1]], and likewise for the
+    in-edges, so the graph costs a few array slots per edge instead of
+    several hash entries. It has the same query API as Graph, and the
+    out_degrees and in_degrees arrays allow vectorized degree scans.
+
+    """
+
+    def __init__(self, edges=()):
+        """Create a graph from an iterable of (distinct) edges."""
+        edges = list(edges)
+        nodes = [m for m, n in edges] + [n for m, n in edges]
+
+        # Strings or ints are relabelled with numpy, other nodes by a dict
+        # from node to id, whose keys in order are the labels.
+        types = set(map(type, nodes))
+        if types <= {str} or types <= {int}:
+            self._ids = None
+            # Packed 32-mer codes can exceed the int64 range.
+            if types == {int} and max(nodes) >= 2 ** 63:
+                nodes = np.array(nodes, dtype=np.uint64)
+            else:
+                nodes = np.array(nodes)
+            # The sorted array of node labels; a label's index is its id.
+            self.labels, ids = np.unique(nodes, return_inverse=True)
+        else:
+            self._ids = {}
+            for node in nodes:
+                self._ids.setdefault(node, len(self._ids))
+            self.labels = list(self._ids)
+            ids = np.fromiter((self._ids[node] for node in nodes),
+                              dtype=np.int64, count=len(nodes))
+        sources, targets = ids[:len(edges)], ids[len(edges):]
+        nnodes = len(self.labels)
+        self.out_offsets, self.out_targets = _csr(sources, targets, nnodes)
+        self.in_offsets, self.in_sources = _csr(targets, sources, nnodes)
+        self.out_degrees = np.diff(self.out_offsets)
+        self.in_degrees = np.diff(self.in_offsets)
+
+    def __len__(self):
+        """Return the number of nodes."""
+        return len(self.labels)
+
+    def __iter__(self):
+        """Iterating over the graph yields its nodes."""
+        return iter(self.label_list(range(len(self))))
+
+    def label_list(self, ids):
+        """Return the list of node labels of a sequence of node ids."""
+        if self._ids is None:
+            return self.labels[list(ids)].tolist()
+        return [self.labels[i] for i in ids]
+
+    def node_id(self, node):
+        """Return the dense integer id of a node, or raise KeyError."""
+        if self._ids is not None:
+            return self._ids[node]
+        i = int(np.searchsorted(self.labels, node))
+        if i == len(self.labels) or self.labels[i] != node:
+            raise KeyError(node)
+        return i
+
+    def out_neighbours(self, node):
+        """Return the list of out-neighbours of a node."""
+        i = self.node_id(node)
+        ids = self.out_targets[self.out_offsets[i]:self.out_offsets[i + 1]]
+        return self.label_list(ids)
+
+    def in_degree(self, node):
+        """Return the number of edges ending at node."""
+        return int(self.in_degrees[self.node_id(node)])
+
+    def out_degree(self, node):
+        """Return the number of edges starting at node."""
+        return int(self.out_degrees[self.node_id(node)])
+
+    def degree(self, node):
+        """Return the number of edges incident to node in either direction."""
+        return self.in_degree(node) + self.out_degree(node)
+
+
 
 def pick_any(iterable):
     """Return any item from iterable, or raise StopIteration if empty."""
@@ -57,84 +153,251 @@ def pick_any(iterable):
 class NoEulerianPath(Exception):
     """Exception raised when there is no Eulerian path."""
 
-def eulerian_path(edges):
+def compact_unitigs(graph):
+    """Collapse the maximal non-branching paths of a CSRGraph into unitigs.
+
+    Return a pair (edges, unitigs). Nodes with one in- and one out-edge
+    are removed and each maximal run of them becomes a new node with id
+    len(graph) + i, whose member node ids are in unitigs[i]. Other nodes
+    keep their ids, so an edge u -> a -> b -> w through such a run
+    becomes u -> U -> w. A cycle made only of such nodes keeps its first
+    node as an anchor. Every unitig has one in- and one out-edge, so an
+    Eulerian path of the compacted edges expands to one of the graph.
+
+    """
+    nnodes = len(graph)
+    simple = ((graph.in_degrees == 1) & (graph.out_degrees == 1)).tolist()
+    offsets = graph.out_offsets.tolist()
+    targets = graph.out_targets.tolist()
+    edges = []
+    unitigs = []
+
+    def add_run(node, run, end):
+        if run:
+            unitig = nnodes + len(unitigs)
+            unitigs.append(run)
+            edges.append((node, unitig))
+            edges.append((unitig, end))
+        else:
+            edges.append((node, end))
+
+    # Follow each out-edge of a branching node through the run of
+    # simple nodes that it starts.
+    visited = [False] * nnodes
+    for node in range(nnodes):
+        if simple[node]:
+            continue
+        for i in range(offsets[node], offsets[node + 1]):
+            run = []
+            end = targets[i]
+            while simple[end]:
+                visited[end] = True
+                run.append(end)
+                end = targets[offsets[end]]
+            add_run(node, run, end)
+
+    # Any simple nodes not yet reached lie on isolated cycles.
+    for node in range(nnodes):
+        if simple[node] and not visited[node]:
+            visited[node] = True
+            run = []
+            end = targets[offsets[node]]
+            while end != node:
+                visited[end] = True
+                run.append(end)
+                end = targets[offsets[end]]
+            add_run(node, run, node)
+
+    return edges, unitigs
+
+def _hierholzer(offsets, targets, start):
+    """Return the node ids of a walk from start that uses every edge
+    reachable from it once, where the out-edges of node i are
+    targets[offsets[i]:offsets[i+1]].
+
+    """
+    # Each node has a cursor into its slice of the out-edge array.
+    # Follow unused edges from the top of the stack until a dead end
+    # is reached, then pop nodes onto the path. Popped nodes are where
+    # closed circuits get spliced into the path, so no separate
+    # stitching step is needed.
+    cursor = offsets[:-1]
+    end = offsets[1:]
+    stack = [start]
+    path = []
+    while stack:
+        node = stack[-1]
+        if cursor[node] < end[node]:
+            stack.append(targets[cursor[node]])
+            cursor[node] += 1
+        else:
+            path.append(stack.pop())
+    path.reverse()
+    return path
+
+def eulerian_path(edges, compact=False):
     """Return an Eulerian path in the directed graph with the given
     iterable of edges, or raise NoEulerianPath if there is no such path.
 
+    Instead of edges, a Graph or CSRGraph may be passed. The graph is
+    only read, never modified, so the same graph can be traversed
+    repeatedly. If compact is true, non-branching paths are first
+    collapsed into unitigs (see compact_unitigs) and the path is found
+    in the smaller graph and then expanded.
+
     """
-    graph = Graph(edges)
-
-    # Mapping from surplus of out-edges over in-edges to list of nodes
-    # with that surplus.
-    surplus = defaultdict(list)
-    for node in graph:
-        in_degree = graph.in_degree(node)
-        out_degree = graph.out_degree(node)
-        degree_surplus = out_degree - in_degree
-        if abs(degree_surplus) > 1:
-            raise NoEulerianPath("Node {} has in-degree {} and out-degree {}."
-                                 .format(node, in_degree, out_degree))
-        surplus[degree_surplus].append(node)
+    if isinstance(edges, CSRGraph):
+        graph = edges
+    elif isinstance(edges, Graph):
+        graph = CSRGraph((m, n) for m in edges for n in edges.out_neighbours(m))
+    else:
+        graph = CSRGraph(set(edges))
+    if not len(graph):
+        raise NoEulerianPath("Graph has no edges.")
+
+    # Check the surplus of out-edges over in-edges of every node at once.
+    surplus = graph.out_degrees - graph.in_degrees
+    unbalanced = np.flatnonzero(np.abs(surplus) > 1)
+    if unbalanced.size:
+        node = unbalanced[0]
+        raise NoEulerianPath("Node {} has in-degree {} and out-degree {}."
+                             .format(graph.label_list([node])[0],
+                                     graph.in_degrees[node],
+                                     graph.out_degrees[node]))
 
     # Find the starting point for the path.
-    if len(surplus[1]) == len(surplus[-1]) == 0:
+    starts = np.flatnonzero(surplus == 1)
+    nodd = starts.size + np.count_nonzero(surplus == -1)
+    if nodd == 0:
         # Any starting point will do.
-        start = pick_any(graph)
-    elif len(surplus[1]) == len(surplus[-1]) == 1:
+        start = None
+    elif nodd == 2 and starts.size == 1:
         # Must start at a node with more out- than in-neighbours.
-        start = pick_any(surplus[1])
+        start = int(starts[0])
     else:
-        raise NoEulerianPath("Graph has {} odd-degree nodes."
-                             .format(len(surplus[1]) + len(surplus[-1])))
-
-    # We'll be following a series of edge-disjoint paths in the graph.
-    # This is a mapping from a node to a deque of the paths starting
-    # at that node, each path being a list of nodes. (The reason for
-    # using a deque is so that we can process these paths in the order
-    # that they were found.)
-    paths = defaultdict(deque)
-
-    # Nodes that have been visited but have unvisited out-neighbours.
-    unfinished = set([start])
-
-    while unfinished:
-        # Pick any unfinished node to start the current path.
-        node = pick_any(unfinished)
-        path = [node]
-        paths[node].append(path)
-
-        # Keep choosing any neighbour and removing the edge just
-        # traversed, until a dead end is reached.
-        while graph.out_degree(node):
-            neighbour = pick_any(graph.out_neighbours(node))
-            graph.remove_edge(node, neighbour)
-            if graph.out_degree(node) == 0:
-                unfinished.remove(node)
-            path.append(neighbour)
-            unfinished.add(neighbour)
-            node = neighbour
-        else:
-            unfinished.remove(node)
+        raise NoEulerianPath("Graph has {} odd-degree nodes.".format(nodd))
+
+    if compact:
+        edges, unitigs = compact_unitigs(graph)
+        offsets, targets = _csr(*zip(*edges), len(graph) + len(unitigs))
+        if start is None:
+            start = edges[0][0]
+    else:
+        offsets, targets = graph.out_offsets, graph.out_targets
+        if start is None:
+            start = 0
+    path = _hierholzer(offsets.tolist(), targets.tolist(), start)
 
-    # If there are any edges remaining, that means the graph was
-    # disconnected.
-    if any(graph.degree(node) for node in graph):
+    # If any edges were not reached, the graph was disconnected.
+    if len(path) != len(targets) + 1:
         raise NoEulerianPath("Graph is not connected.")
 
-    # Concatenate the individual paths into one continuous path (using
-    # the "stack of iterators" pattern).
-    path = []
-    stack = [iter(paths[start].popleft())]
-    while stack:
-        for node in stack[-1]:
-            if paths[node]:
-                stack.append(iter(paths[node].popleft()))
-                break
+    if compact:
+        nnodes = len(graph)
+        ids = []
+        for node in path:
+            if node < nnodes:
+                ids.append(node)
             else:
-                path.append(node)
+                ids.extend(unitigs[node - nnodes])
+        path = ids
+    return graph.label_list(path)
+
+def bidirected_eulerian_path(edges, flip):
+    """Return a path that traverses each edge of a bidirected graph
+    exactly once, or raise NoEulerianPath if there is no such path.
+
+    Each edge (m, n) can be traversed either forwards from m to n, or
+    backwards from flip(n) to flip(m), where flip maps a node to the
+    same node read on the opposite strand (for example its reverse
+    complement). The returned path is a list of oriented nodes. The
+    nodes must be mutually comparable; the edges are sorted first so
+    that the result does not depend on their order.
+
+    """
+    edges = sorted(edges)
+    if not edges:
+        raise NoEulerianPath("Graph has no edges.")
+
+    # A node and its flip are two orientations of one node, keyed by the
+    # smaller. Its edge ends lie on two sides: leaving the key orientation
+    # uses the exit side, and arriving at the flipped orientation uses
+    # the same side. A node equal to its flip has only the one side.
+    def key(node):
+        return min(node, flip(node))
+
+    def leaving(node):
+        return key(node), node == key(node)
+
+    def arriving(node):
+        return key(node), node != key(node) or node == flip(node)
+
+    # A walk passing through a node uses one end on each side (or two on
+    # the one side), so only its two ends may be unbalanced.
+    ends = defaultdict(int)
+    for m, n in edges:
+        ends[leaving(m)] += 1
+        ends[arriving(n)] += 1
+    surplus = {}
+    for node in {node for node, side in ends}:
+        if node == flip(node):
+            surplus[node] = ends.get((node, True), 0) % 2
+        else:
+            surplus[node] = (ends.get((node, True), 0)
+                             - ends.get((node, False), 0))
+    nunpaired = sum(abs(value) for value in surplus.values())
+    if nunpaired > 2:
+        raise NoEulerianPath("Graph has {} unpaired edge ends."
+                             .format(nunpaired))
+
+    # Start at an unbalanced node, oriented to leave by its extra side.
+    start = edges[0][0]
+    for node in sorted(surplus):
+        if surplus[node] > 0:
+            start = node
+            break
+        if surplus[node] < 0:
+            start = flip(node)
+            break
+
+    # Expand each edge into its two orientations (one, if the edge is
+    # its own reverse) in a directed graph. Both orientations share an
+    # index into `used` so that taking one of them uses up the other.
+    out = defaultdict(list)
+    for index, (m, n) in enumerate(edges):
+        for a, b in sorted({(m, n), (flip(n), flip(m))}):
+            out[a].append((b, index))
+
+    # Hierholzer's algorithm over per-node cursors into the adjacency
+    # lists, skipping edges whose other orientation was already taken.
+    # Each stack entry records the node we arrived from. As the sides
+    # are balanced away from the ends, a walk only gets stuck at the end
+    # of the path or where it set out, so circuits splice in on strand.
+    used = [False] * len(edges)
+    cursor = defaultdict(int)
+    stack = [(start, None)]
+    popped = []
+    while stack:
+        node, source = stack[-1]
+        adjacent = out[node]
+        i = cursor[node]
+        while i < len(adjacent) and used[adjacent[i][1]]:
+            i += 1
+        cursor[node] = i + 1
+        if i < len(adjacent):
+            neighbour, index = adjacent[i]
+            used[index] = True
+            stack.append((neighbour, node))
         else:
-            stack.pop()
+            popped.append(stack.pop())
+    popped.reverse()
+
+    if not all(used):
+        raise NoEulerianPath("Graph is not connected.")
 
-    # Check that we concatenated all the paths.
-    assert not any(paths.values())
-    return path
\ No newline at end of file
+    # Guard against a spliced circuit that joins the path on the other
+    # strand, which would leave a jump in the result.
+    for (node, _), (_, source) in zip(popped, popped[1:]):
+        if source != node:
+            raise NoEulerianPath("No single walk covers both strands.")
+    return [node for node, _ in popped]
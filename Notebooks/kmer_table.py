@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+An on-disk kmer table of sorted packed kmer codes and their counts that is
+opened with numpy.memmap, so a counted dataset can be reopened instantly
+and shared between processes through the page cache.
+"""
+
+
+import os
+import numpy as np
+import debruijn_funcs
+
+
+## file layout: a 64 byte header followed by n uint64 codes and n int64 counts
+MAGIC = b"KMERTBL1"
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("k", "<u8"),
+    ("canonical", "<u8"),
+    ("nkmers", "<u8"),
+    ("padding", "V32"),
+])
+
+
+
+def write_kmer_table(path, codes, counts, k, canonical=False):
+    """
+    writes sorted unique packed kmer codes and counts, as returned by
+    reads_to_kmer_arrays, to a kmer table file at path. The file is
+    written aside and moved into place so open tables are not disturbed.
+    """
+    codes = np.ascontiguousarray(codes, dtype="<u8")
+    counts = np.ascontiguousarray(counts, dtype="<i8")
+    if codes.shape != counts.shape:
+        raise ValueError("codes and counts must be the same length")
+    if codes.size > 1 and np.any(codes[1:] <= codes[:-1]):
+        raise ValueError("codes must be sorted and unique")
+
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["k"] = k
+    header["canonical"] = canonical
+    header["nkmers"] = codes.size
+    tmppath = "{}.tmp{}".format(path, os.getpid())
+    with open(tmppath, "wb") as out:
+        out.write(header.tobytes())
+        out.write(codes.tobytes())
+        out.write(counts.tobytes())
+    os.replace(tmppath, path)
+
+
+
+def save_kmers(path, kmers, k, canonical=False):
+    "writes a kmers dict (str or packed int keys) to a kmer table file"
+    codes = np.fromiter(
+        (kmer if isinstance(kmer, int) else debruijn_funcs.encode_kmer(kmer)
+         for kmer in kmers),
+        dtype=np.uint64, count=len(kmers))
+    counts = np.fromiter(kmers.values(), dtype=np.int64, count=len(kmers))
+    order = np.argsort(codes)
+    write_kmer_table(path, codes[order], counts[order], k, canonical)
+
+
+
+class KmerTable():
+    """
+    A read-only kmer table memory-mapped from a file written by
+    write_kmer_table. Behaves like a kmers dict keyed by packed int codes,
+    so it can be passed to get_debruijn_edges(table, k=table.k).
+    """
+    def __init__(self, path):
+
+        ## read and check the header
+        header = np.fromfile(path, dtype=HEADER, count=1)
+        if header.size != 1 or header["magic"][0] != MAGIC:
+            raise ValueError("{} is not a kmer table file".format(path))
+        self.path = path
+        self.k = int(header["k"][0])
+        self.canonical = bool(header["canonical"][0])
+        nkmers = int(header["nkmers"][0])
+
+        ## map the arrays without reading them into memory
+        self.codes = np.memmap(
+            path, dtype="<u8", mode="r", offset=HEADER.itemsize,
+            shape=(nkmers,)) if nkmers else np.empty(0, dtype="<u8")
+        self.counts = np.memmap(
+            path, dtype="<i8", mode="r", offset=HEADER.itemsize + 8 * nkmers,
+            shape=(nkmers,)) if nkmers else np.empty(0, dtype="<i8")
+
+
+    def __len__(self):
+        return self.codes.size
+
+
+    def __iter__(self):
+        "yields the packed codes as ints, in sorted order"
+        for i in range(0, self.codes.size, 65536):
+            yield from self.codes[i:i+65536].tolist()
+
+
+    def __contains__(self, code):
+        return self.get(code) is not None
+
+
+    def __getitem__(self, code):
+        count = self.get(code)
+        if count is None:
+            raise KeyError(code)
+        return count
+
+
+    def keys(self):
+        return iter(self)
+
+
+    def get(self, code, default=None):
+        "returns the count of a packed kmer code, or default if absent"
+        i = np.searchsorted(self.codes, np.uint64(code))
+        if i < self.codes.size and self.codes[i] == code:
+            return int(self.counts[i])
+        return default
+
+
+    def lookup(self, codes):
+        "returns an array of counts for an array of codes (0 if absent)"
+        codes = np.asarray(codes, dtype=np.uint64)
+        counts = np.zeros(codes.shape, dtype=np.int64)
+        if self.codes.size:
+            idx = np.minimum(np.searchsorted(self.codes, codes),
+                             self.codes.size - 1)
+            found = self.codes[idx] == codes
+            counts[found] = self.counts[idx[found]]
+        return counts
+
+
+    def to_dict(self, min_count=1):
+        "returns a kmers dict of the codes seen at least min_count times"
+        keep = self.counts >= min_count
+        return dict(zip(self.codes[keep].tolist(), self.counts[keep].tolist()))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+"""
+An asyncio service that runs assembly jobs sent over a Unix socket or a
+localhost TCP port, so that many clients can submit assemblies without
+each paying for Python startup and imports. Each line a client sends is
+a JSON job of sweep parameters (see assembler.SWEEP_DEFAULTS), e.g.:
+
+    {"id": "a", "target_size": 1000, "nreads": 2000, "k": 25, "seed": 1}
+
+and each line sent back is a JSON message with the job's id: "queued",
+then a "stage" message with the stats of each pipeline stage as it
+finishes, then "done" with the result of assembler.run_cell (or "error").
+
+    python service.py serve --socket /tmp/assembler.sock
+    python service.py submit --socket /tmp/assembler.sock '{"k": 25}'
+"""
+
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import assembler
+
+
+## the queue a worker process sends job messages back on
+_EVENTS = None
+
+
+
+def _warm_worker(events):
+    "stores the event queue and runs a tiny assembly to warm up imports"
+    global _EVENTS
+    _EVENTS = events
+    cell = dict(assembler.SWEEP_DEFAULTS, target_size=100, nreads=100, k=10)
+    assembler.run_cell(cell)
+
+
+
+def _ready():
+    "a no-op task used to start the worker processes"
+    return os.getpid()
+
+
+
+def _run_job(job_id, cell, seed):
+    """
+    runs one job in a worker process. The stats of each stage and then
+    the result or error are put on the event queue, so that the messages
+    of a job arrive in order.
+    """
+    def hook(stage, record):
+        _EVENTS.put((job_id, dict(record, status="stage", stage=stage)))
+
+    try:
+        result = assembler.run_cell(cell, seed, hook=hook)
+    except Exception as err:
+        _EVENTS.put((job_id, {"status": "error", "error": repr(err)}))
+    else:
+        _EVENTS.put((job_id, {"status": "done", "result": result}))
+
+
+
+def parse_job(line):
+    """
+    returns (id, cell, seed) from a JSON job line, with any missing
+    parameter taken from SWEEP_DEFAULTS. Raises ValueError if the line is
+    not a JSON object of known parameters.
+    """
+    job = json.loads(line)
+    if not isinstance(job, dict):
+        raise ValueError("a job must be a JSON object")
+    client_id = job.pop("id", None)
+    seed = job.pop("seed", 123)
+    unknown = set(job) - set(assembler.SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError("unknown job parameters: {}".format(
+            ", ".join(sorted(unknown))))
+    cell = dict(assembler.SWEEP_DEFAULTS)
+    cell.update(job)
+    return client_id, cell, seed
+
+
+
+class AssemblyService():
+    """
+    Accepts jobs from any number of clients into a queue of up to
+    max_queued jobs (a client's jobs wait to be read while it is full)
+    and runs them on a pool of worker processes, one job per worker at a
+    time. The workers are started and warmed up before the service
+    accepts connections, and stay up between jobs.
+    """
+    def __init__(self, workers=None, max_queued=100):
+
+        ## store attributes
+        self.workers = workers or os.cpu_count()
+        self.max_queued = max_queued
+        self.address = None
+
+        ## running jobs {id: (writer, client id, finished future)}
+        self._jobs = {}
+        self._ids = itertools.count()
+        self._queue = None
+        self._pool = None
+        self._events = None
+
+
+    async def serve(self, path=None, host="127.0.0.1", port=0):
+        """
+        runs the service on a Unix socket at path, or else on host:port
+        (port 0 picks a free port, see self.address), until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context()
+        self._events = context.Queue()
+        self._queue = asyncio.Queue(self.max_queued)
+        self._pool = ProcessPoolExecutor(
+            self.workers, mp_context=context,
+            initializer=_warm_worker, initargs=(self._events,))
+
+        ## start every worker before taking jobs
+        await asyncio.gather(*(
+            loop.run_in_executor(self._pool, _ready)
+            for i in range(self.workers)))
+        relay = loop.run_in_executor(None, self._relay, loop)
+        dispatchers = [
+            asyncio.create_task(self._dispatch()) for i in range(self.workers)]
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        self.address = server.sockets[0].getsockname()
+        print("serving on {}".format(self.address), file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in dispatchers:
+                task.cancel()
+            self._events.put(None)
+            await relay
+            self._pool.shutdown(cancel_futures=True)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+    def _relay(self, loop):
+        "forwards messages from the worker processes to the event loop"
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            loop.call_soon_threadsafe(self._deliver, *event)
+
+
+    def _deliver(self, job_id, message):
+        "sends a message to the client of a job, and ends the job if final"
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return
+        writer, client_id, finished = entry
+        self._send(writer, client_id, message)
+        if message["status"] in ("done", "error"):
+            del self._jobs[job_id]
+            finished.set_result(None)
+
+
+    def _send(self, writer, client_id, message):
+        "writes a message as a JSON line unless the client has gone"
+        if not writer.is_closing():
+            message = dict(message, id=client_id)
+            writer.write(json.dumps(message).encode() + b"\n")
+
+
+    async def _dispatch(self):
+        "runs queued jobs in the pool one at a time"
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, cell, seed = await self._queue.get()
+            try:
+                await loop.run_in_executor(
+                    self._pool, _run_job, job_id, cell, seed)
+            except Exception as err:
+                ## the pool failed, e.g., a worker process was killed
+                self._deliver(job_id, {"status": "error", "error": repr(err)})
+
+
+    async def _handle(self, reader, writer):
+        """
+        reads job lines from a client until it closes its end, then waits
+        for its jobs to finish before closing the connection
+        """
+        loop = asyncio.get_running_loop()
+        pending = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    client_id, cell, seed = parse_job(line)
+                except ValueError as err:
+                    self._send(writer, None, {"status": "error",
+                                              "error": str(err)})
+                    continue
+
+                job_id = next(self._ids)
+                finished = loop.create_future()
+                self._jobs[job_id] = (writer, client_id, finished)
+                pending.append(finished)
+                await self._queue.put((job_id, cell, seed))
+                self._send(writer, client_id, {"status": "queued"})
+                await writer.drain()
+            await asyncio.gather(*pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+
+async def submit(jobs, path=None, host="127.0.0.1", port=None):
+    """
+    sends a list of jobs, as dicts or JSON strings, to a running service
+    at a Unix socket path or host:port, and yields each message sent back
+    until all are done
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    for job in jobs:
+        if not isinstance(job, str):
+            job = json.dumps(job)
+        writer.write(job.encode() + b"\n")
+    await writer.drain()
+    writer.write_eof()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+
+def main(argv=None):
+    "runs the service, or submits jobs to one and prints its messages"
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("command", choices=["serve", "submit"])
+    parser.add_argument("jobs", nargs="*", help="JSON jobs to submit")
+    parser.add_argument("--socket", help="path of a Unix socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-queued", type=int, default=100)
+    args = parser.parse_intermixed_args(argv)
+
+    if args.command == "serve":
+        service = AssemblyService(args.workers, args.max_queued)
+        try:
+            asyncio.run(service.serve(args.socket, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    async def print_messages():
+        async for message in submit(
+                args.jobs, args.socket, args.host, args.port):
+            print(json.dumps(message))
+
+    asyncio.run(print_messages())
+    return 0
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
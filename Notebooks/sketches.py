@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+Probabilistic summaries of kmer sets for bounded-memory counting.
+"""
+
+
+import math
+import numpy as np
+
+
+## constants for mixing a hash into two independent 64-bit hashes
+MASK64 = (1 << 64) - 1
+MIX1 = 0x9E3779B97F4A7C15
+MIX2 = 0xBF58476D1CE4E5B9
+
+
+
+def _two_hashes(item):
+    "returns two 64-bit hashes of an item for double hashing"
+    h = hash(item) & MASK64
+    h1 = (h * MIX1) & MASK64
+    h2 = (((h ^ (h >> 31)) * MIX2) & MASK64) | 1
+    return h1, h2
+
+
+
+class BloomFilter():
+    """
+    A set membership filter with no false negatives and a false positive
+    rate of about fp_rate once it holds `expected` items. The bit array
+    and number of hashes are sized from those two parameters.
+    """
+    def __init__(self, expected, fp_rate=0.01):
+
+        ## m = -n ln(p) / ln(2)^2 bits and (m / n) ln(2) hashes
+        expected = max(1, expected)
+        self.nbits = max(8, int(-expected * math.log(fp_rate) / math.log(2) ** 2))
+        self.nhashes = max(1, round(self.nbits / expected * math.log(2)))
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+
+    def _positions(self, item):
+        h1, h2 = _two_hashes(item)
+        return [(h1 + i * h2) % self.nbits for i in range(self.nhashes)]
+
+
+    def add(self, item):
+        "adds an item and returns True if it was (probably) already present"
+        present = True
+        bits = self.bits
+        for pos in self._positions(item):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not bits[byte] & bit:
+                present = False
+                bits[byte] |= bit
+        return present
+
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+
+
+class CountMinSketch():
+    """
+    A fixed-size approximate counter of packed kmer codes: a depth x width
+    array of counters, one row per hash function. Estimates are never
+    below the true count and exceed it by at most about e/width of the
+    total count with probability 1 - exp(-depth). The hashes depend only
+    on width, depth and seed, so sketches built with the same settings in
+    different processes can be merged by adding their counters.
+    """
+    def __init__(self, width=2**20, depth=4, seed=0):
+
+        ## width is rounded up to a power of two for multiply-shift hashing
+        self.bits = max(1, int(math.ceil(math.log2(width))))
+        self.width = 1 << self.bits
+        self.depth = depth
+        self.seed = seed
+        self.table = np.zeros((depth, self.width), dtype=np.uint32)
+
+        ## an odd multiplier and an offset for each row's hash
+        rng = np.random.default_rng(seed)
+        self._mult = rng.integers(0, 2**63, size=depth, dtype=np.uint64) * 2 + 1
+        self._add = rng.integers(0, 2**63, size=depth, dtype=np.uint64)
+
+
+    def _columns(self, codes):
+        "returns a depth x n array of the counter index of each code per row"
+        codes = np.asarray(codes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = self._mult[:, None] * codes[None, :] + self._add[:, None]
+        return (hashed >> np.uint64(64 - self.bits)).astype(np.int64)
+
+
+    def update(self, codes, counts=None):
+        "adds counts (default 1 each) for an array of packed kmer codes"
+        codes = np.asarray(codes, dtype=np.uint64)
+        if counts is None:
+            counts = np.ones(codes.size, dtype=np.uint32)
+        counts = np.asarray(counts, dtype=np.uint32)
+        columns = self._columns(codes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+
+
+    def query(self, codes):
+        "returns an array of estimated counts for an array of packed codes"
+        columns = self._columns(codes)
+        rows = np.arange(self.depth)[:, None]
+        return self.table[rows, columns].min(axis=0)
+
+
+    def __getitem__(self, code):
+        return int(self.query([code])[0])
+
+
+    def merge(self, other):
+        "adds the counts of a sketch built with the same settings to this one"
+        if (other.width, other.depth, other.seed) != (self.width, self.depth, self.seed):
+            raise ValueError("only sketches with equal width, depth and seed merge")
+        self.table += other.table
+        return self